@@ -1,27 +1,103 @@
 # app.py
-from flask import Flask, g, request, jsonify, render_template, send_file, render_template_string, make_response
-import sqlite3, os, csv
+from flask import Flask, g, request, jsonify, render_template, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import orjson
+import sqlite3, os, csv, threading, time, queue
 from datetime import datetime
-from io import BytesIO, StringIO
+from io import StringIO
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 
 DB_PATH = "data.db"
+LOW_STOCK_THRESHOLD = 10
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+POOL_SIZE = 8  # idle connections kept open per process
+OPTIMIZE_INTERVAL = 3600  # seconds between PRAGMA optimize runs per connection
+# invoice line statements, shared so executemany prepares each once per batch
+_INSERT_ITEM_SQL = "INSERT INTO invoice_items (invoice_id, product_id, item, qty, price, discount, tax, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_DEC_STOCK_SQL = "UPDATE products SET qty = qty - ? WHERE id=?"
+_INC_STOCK_SQL = "UPDATE products SET qty = qty + ? WHERE id=?"
+INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_items_invoice ON invoice_items(invoice_id);
+    CREATE INDEX IF NOT EXISTS idx_items_item ON invoice_items(item);
+    CREATE INDEX IF NOT EXISTS idx_invoices_year ON invoices(year);
+    CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date);
+"""
+
+class OrjsonProvider(DefaultJSONProvider):
+    # jsonify through orjson: serializes faster and writes bytes directly.
+    # sort_keys and compact/debug indenting are honoured; ensure_ascii is not
+    # (orjson always emits UTF-8) and other json.dumps kwargs are ignored.
+    def _options(self, sort_keys, indent):
+        option = 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._options(kwargs.get("sort_keys", self.sort_keys), kwargs.get("indent"))
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._options(self.sort_keys, pretty)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype)
+
 app = Flask(__name__, template_folder="templates")
+app.json = OrjsonProvider(app)
+# idle connections are shared by all threads of a process, so reuse does not
+# depend on the server reusing threads (the threaded dev server does not)
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_schema_lock = threading.Lock()
+_schema_ready = False
 
 
 # -----------------------
 # DB helpers & init
 # -----------------------
+class PooledConnection(sqlite3.Connection):
+    optimized_at = 0.0
+
 def get_db():
     db = getattr(g, "_database", None)
     if db is None:
-        need_init = not os.path.exists(DB_PATH)
-        db = g._database = sqlite3.connect(DB_PATH)
+        try:
+            db = _pool.get_nowait()
+        except queue.Empty:
+            db = connect_db()
+        g._database = db
+    return db
+
+def connect_db():
+    global _schema_ready
+    with _schema_lock:
+        need_init = not _schema_ready and not os.path.exists(DB_PATH)
+        # isolation_level=None: transactions are opened explicitly with BEGIN
+        db = sqlite3.connect(DB_PATH, timeout=5.0, isolation_level=None, check_same_thread=False, factory=PooledConnection)
         db.row_factory = sqlite3.Row
-        if need_init:
-            init_db(db)
+        db.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-20000;
+        PRAGMA mmap_size=134217728;
+        """)
+        db.optimized_at = time.monotonic()
+        # schema setup runs once per process, not once per connection
+        if not _schema_ready:
+            if need_init:
+                init_db(db)
+            else:
+                upgrade_db(db)
+            _schema_ready = True
     return db
 
 def init_db(db):
@@ -63,28 +139,126 @@ def init_db(db):
         tax REAL,
         amount REAL
     );
-    """)
+    CREATE TABLE invoice_seq (
+        year INTEGER PRIMARY KEY,
+        seq INTEGER NOT NULL
+    );
+    """ + INDEXES_SQL)
     db.commit()
 
+def upgrade_db(db):
+    # retrofit tables/indexes onto databases created before they were added
+    has_seq = db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='invoice_seq'").fetchone()
+    if not has_seq:
+        # seed counters from the highest number already issued each year, in one
+        # write transaction; the upsert never lowers a counter another process
+        # may already have bumped
+        try:
+            db.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS invoice_seq (
+                year INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL
+            );
+            INSERT INTO invoice_seq (year, seq)
+                SELECT year, MAX(CAST(substr(invoice_no, 10) AS INTEGER)) FROM invoices
+                WHERE year IS NOT NULL GROUP BY year
+                ON CONFLICT(year) DO UPDATE SET seq = MAX(seq, excluded.seq);
+            COMMIT;
+            """)
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+    db.executescript(INDEXES_SQL)
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, "_database", None)
-    if db is not None:
+    # hand the connection back to the pool; close it only if the pool is full
+    db = g.pop("_database", None)
+    if db is None:
+        return
+    if db.in_transaction:
+        db.rollback()
+    # pooled connections stay open, so refresh planner stats periodically
+    optimized = time.monotonic() - db.optimized_at > OPTIMIZE_INTERVAL
+    if optimized:
+        optimize_db(db)
+    try:
+        _pool.put_nowait(db)
+    except queue.Full:
+        if not optimized:
+            optimize_db(db)
         db.close()
 
+def optimize_db(db):
+    # best effort: optimize may run ANALYZE, which needs the write lock, and
+    # a busy database must not fail the request or leak the connection
+    try:
+        db.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    db.optimized_at = time.monotonic()
+
 
 # -----------------------
 # Utility functions
 # -----------------------
-def next_invoice_no(db_conn):
+def newest_first(select_sql):
+    # ORDER BY id DESC, with opt-in keyset paging via ?limit=&after_id=
+    limit = request.args.get("limit", type=int)
+    after_id = request.args.get("after_id", type=int)
+    if limit is None and after_id is None:
+        return select_sql + " ORDER BY id DESC", ()
+    params = []
+    if after_id is not None:
+        select_sql += " WHERE id < ?"
+        params.append(after_id)
+    params.append(min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE))
+    return select_sql + " ORDER BY id DESC LIMIT ?", params
+
+def next_invoice_no(db_conn, now):
     cur = db_conn.cursor()
-    y = datetime.now().year
-    cur.execute("SELECT COUNT(*) as cnt FROM invoices WHERE year=?", (y,))
-    cnt = cur.fetchone()["cnt"]
-    seq = cnt + 1
+    y = now.year
+    # atomic per-year counter; call inside the invoice-save transaction
+    cur.execute("INSERT INTO invoice_seq (year, seq) VALUES (?, 1) ON CONFLICT(year) DO UPDATE SET seq = seq + 1 RETURNING seq", (y,))
+    seq = cur.fetchone()["seq"]
     invoice_no = f"INV-{y}-{seq:04d}"
     return invoice_no, y
 
+def stock_error(cur, items):
+    # one IN query for every product on the invoice instead of a SELECT per line
+    pids = [int(it.get("product_id") or 0) for it in items if it.get("product_id")]
+    if not pids:
+        return None
+    rows = cur.execute(f"SELECT id, qty, name FROM products WHERE id IN ({','.join('?' * len(pids))})", pids).fetchall()
+    stock = {r["id"]: (r["qty"], r["name"]) for r in rows}
+    for it in items:
+        pid = int(it.get("product_id") or 0)
+        qty = int(it.get("qty") or 0)
+        if pid in stock and stock[pid][0] < qty:
+            have, name = stock[pid]
+            return f"Insufficient stock for {name} (have {have}, need {qty})"
+    return None
+
+def restore_stock(cur, invoice_id):
+    # put an invoice's quantities back, one UPDATE per distinct product
+    old_items = cur.execute("SELECT product_id, SUM(qty) AS qty FROM invoice_items WHERE invoice_id=? AND product_id GROUP BY product_id", (invoice_id,)).fetchall()
+    cur.executemany(_INC_STOCK_SQL, [(r["qty"], r["product_id"]) for r in old_items])
+
+def invoice_item_rows(invoice_id, items):
+    # build (invoice_items rows, stock decrement rows) for executemany
+    items_rows = [(invoice_id,
+                   int(it.get("product_id") or 0),
+                   it.get("item") or "",
+                   int(it.get("qty") or 0),
+                   float(it.get("price") or 0),
+                   float(it.get("discount") or 0),
+                   float(it.get("tax") or 0),
+                   float(it.get("amount") or 0)) for it in items]
+    stock_rows = [(r[3], r[1]) for r in items_rows if r[1]]
+    return items_rows, stock_rows
+
 
 # -----------------------
 # UI route
@@ -100,7 +274,7 @@ def index():
 @app.route("/api/products", methods=["GET"])
 def api_products():
     db = get_db()
-    rows = db.execute("SELECT id, name, qty, price, category, default_tax, default_discount FROM products ORDER BY id DESC").fetchall()
+    rows = db.execute(*newest_first("SELECT id, name, qty, price, category, default_tax, default_discount FROM products")).fetchall()
     return jsonify([dict(r) for r in rows])
 
 @app.route("/api/product/add", methods=["POST"])
@@ -150,7 +324,7 @@ def api_product_delete():
 @app.route("/api/customers", methods=["GET"])
 def api_customers():
     db = get_db()
-    rows = db.execute("SELECT id, name, phone, address FROM customers ORDER BY id DESC").fetchall()
+    rows = db.execute(*newest_first("SELECT id, name, phone, address FROM customers")).fetchall()
     return jsonify([dict(r) for r in rows])
 
 @app.route("/api/customer/add", methods=["POST"])
@@ -171,7 +345,7 @@ def api_customer_add():
 @app.route("/api/invoices", methods=["GET"])
 def api_invoices():
     db = get_db()
-    rows = db.execute("SELECT id, invoice_no, customer_name, customer_phone, date, total FROM invoices ORDER BY id DESC").fetchall()
+    rows = db.execute(*newest_first("SELECT id, invoice_no, customer_name, customer_phone, date, total FROM invoices")).fetchall()
     return jsonify([dict(r) for r in rows])
 
 @app.route("/api/invoice/<int:inv_id>", methods=["GET"])
@@ -180,7 +354,7 @@ def api_invoice_detail(inv_id):
     inv = db.execute("SELECT * FROM invoices WHERE id=?", (inv_id,)).fetchone()
     if not inv:
         return jsonify(error="Not found"), 404
-    items = db.execute("SELECT * FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
+    items = db.execute("SELECT product_id, item, qty, price, discount, tax, amount FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
     return jsonify(invoice=dict(inv), items=[dict(r) for r in items])
 
 @app.route("/api/invoice/save", methods=["POST"])
@@ -189,43 +363,36 @@ def api_invoice_save():
     customer_id = data.get("customer_id")
     customer_name = data.get("customer") or ""
     customer_phone = data.get("phone") or ""
-    inv_date = data.get("date") or datetime.now().strftime("%Y-%m-%d")
+    now = datetime.now()
+    inv_date = data.get("date") or now.strftime("%Y-%m-%d")
     total = float(data.get("total") or 0)
     items = data.get("items") or []
 
     db = get_db()
     cur = db.cursor()
-
-    # generate invoice number and year
-    invoice_no, year = next_invoice_no(db)
-
-    # stock check
-    for it in items:
-        pid = int(it.get("product_id") or 0)
-        qty = int(it.get("qty") or 0)
-        if pid:
-            prod = db.execute("SELECT qty, name FROM products WHERE id=?", (pid,)).fetchone()
-            if prod and prod["qty"] < qty:
-                return jsonify(success=False, error=f"Insufficient stock for {prod['name']} (have {prod['qty']}, need {qty})"), 400
-
-    cur.execute("INSERT INTO invoices (invoice_no, year, customer_id, customer_name, customer_phone, date, total) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (invoice_no, year, customer_id, customer_name, customer_phone, inv_date, total))
-    invoice_id = cur.lastrowid
-
-    for it in items:
-        product_id = int(it.get("product_id") or 0)
-        item_name = it.get("item") or ""
-        qty = int(it.get("qty") or 0)
-        price = float(it.get("price") or 0)
-        discount = float(it.get("discount") or 0)
-        tax = float(it.get("tax") or 0)
-        amount = float(it.get("amount") or 0)
-        cur.execute("INSERT INTO invoice_items (invoice_id, product_id, item, qty, price, discount, tax, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (invoice_id, product_id, item_name, qty, price, discount, tax, amount))
-        if product_id:
-            cur.execute("UPDATE products SET qty = qty - ? WHERE id=?", (qty, product_id))
-
-    db.commit()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+
+        # generate invoice number and year
+        invoice_no, year = next_invoice_no(db, now)
+
+        # stock check
+        error = stock_error(cur, items)
+        if error:
+            db.rollback()
+            return jsonify(success=False, error=error), 400
+
+        cur.execute("INSERT INTO invoices (invoice_no, year, customer_id, customer_name, customer_phone, date, total) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (invoice_no, year, customer_id, customer_name, customer_phone, inv_date, total))
+        invoice_id = cur.lastrowid
+
+        items_rows, stock_rows = invoice_item_rows(invoice_id, items)
+        cur.executemany(_INSERT_ITEM_SQL, items_rows)
+        cur.executemany(_DEC_STOCK_SQL, stock_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return jsonify(success=True, id=invoice_id, invoice_no=invoice_no)
 
 @app.route("/api/invoice/update/<int:inv_id>", methods=["POST"])
@@ -239,52 +406,43 @@ def api_invoice_update(inv_id):
 
     db = get_db()
     cur = db.cursor()
-    # restore stock from old items
-    old_items = cur.execute("SELECT product_id, qty FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
-    for oi in old_items:
-        if oi["product_id"]:
-            cur.execute("UPDATE products SET qty = qty + ? WHERE id=?", (oi["qty"], oi["product_id"]))
-    # delete old items
-    cur.execute("DELETE FROM invoice_items WHERE invoice_id=?", (inv_id,))
-    # stock check for new items
-    for it in items:
-        pid = int(it.get("product_id") or 0)
-        qty = int(it.get("qty") or 0)
-        if pid:
-            prod = cur.execute("SELECT qty, name FROM products WHERE id=?", (pid,)).fetchone()
-            if prod and prod["qty"] < qty:
-                db.rollback()
-                return jsonify(success=False, error=f"Insufficient stock for {prod['name']} (have {prod['qty']}, need {qty})"), 400
-    # insert new items and deduct stock
-    for it in items:
-        product_id = int(it.get("product_id") or 0)
-        item_name = it.get("item") or ""
-        qty = int(it.get("qty") or 0)
-        price = float(it.get("price") or 0)
-        discount = float(it.get("discount") or 0)
-        tax = float(it.get("tax") or 0)
-        amount = float(it.get("amount") or 0)
-        cur.execute("INSERT INTO invoice_items (invoice_id, product_id, item, qty, price, discount, tax, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (inv_id, product_id, item_name, qty, price, discount, tax, amount))
-        if product_id:
-            cur.execute("UPDATE products SET qty = qty - ? WHERE id=?", (qty, product_id))
-    # update invoice header
-    cur.execute("UPDATE invoices SET customer_name=?, customer_phone=?, date=?, total=? WHERE id=?", (customer_name, customer_phone, inv_date, total, inv_id))
-    db.commit()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        # restore stock from old items
+        restore_stock(cur, inv_id)
+        # delete old items
+        cur.execute("DELETE FROM invoice_items WHERE invoice_id=?", (inv_id,))
+        # stock check for new items
+        error = stock_error(cur, items)
+        if error:
+            db.rollback()
+            return jsonify(success=False, error=error), 400
+        # insert new items and deduct stock
+        items_rows, stock_rows = invoice_item_rows(inv_id, items)
+        cur.executemany(_INSERT_ITEM_SQL, items_rows)
+        cur.executemany(_DEC_STOCK_SQL, stock_rows)
+        # update invoice header
+        cur.execute("UPDATE invoices SET customer_name=?, customer_phone=?, date=?, total=? WHERE id=?", (customer_name, customer_phone, inv_date, total, inv_id))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return jsonify(success=True)
 
 @app.route("/api/invoice/delete/<int:inv_id>", methods=["POST"])
 def api_invoice_delete(inv_id):
     db = get_db()
     cur = db.cursor()
-    # restore stock
-    items = cur.execute("SELECT product_id, qty FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
-    for it in items:
-        if it["product_id"]:
-            cur.execute("UPDATE products SET qty = qty + ? WHERE id=?", (it["qty"], it["product_id"]))
-    cur.execute("DELETE FROM invoice_items WHERE invoice_id=?", (inv_id,))
-    cur.execute("DELETE FROM invoices WHERE id=?", (inv_id,))
-    db.commit()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        # restore stock
+        restore_stock(cur, inv_id)
+        cur.execute("DELETE FROM invoice_items WHERE invoice_id=?", (inv_id,))
+        cur.execute("DELETE FROM invoices WHERE id=?", (inv_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return jsonify(success=True)
 
 
@@ -302,6 +460,14 @@ def api_report_sales_summary():
         rows = cur.execute("SELECT date as period, SUM(total) as total FROM invoices GROUP BY date ORDER BY date DESC").fetchall()
     return jsonify([dict(r) for r in rows])
 
+@app.route("/api/dashboard", methods=["GET"])
+def api_dashboard():
+    db = get_db()
+    totals = db.execute("SELECT COUNT(*) as products, COALESCE(SUM(qty*price), 0) as total_value, COALESCE(SUM(qty < ?), 0) as low_stock FROM products",
+                        (LOW_STOCK_THRESHOLD,)).fetchone()
+    cats = db.execute("SELECT COALESCE(NULLIF(category, ''), 'Uncategorized') as category, SUM(qty) as qty FROM products GROUP BY 1 ORDER BY 1").fetchall()
+    return jsonify(**dict(totals), categories=[dict(r) for r in cats])
+
 @app.route("/api/reports/top_products", methods=["GET"])
 def api_report_top_products():
     db = get_db()
@@ -315,39 +481,21 @@ def api_report_top_products():
 @app.route("/invoice/<int:inv_id>/print", methods=["GET"])
 def invoice_print_view(inv_id):
     db = get_db()
-    inv = db.execute("SELECT * FROM invoices WHERE id=?", (inv_id,)).fetchone()
+    inv = db.execute("SELECT invoice_no, customer_name, customer_phone, date, total FROM invoices WHERE id=?", (inv_id,)).fetchone()
     if not inv:
         return "Invoice not found", 404
-    items = db.execute("SELECT * FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
-    html = render_template_string("""
-    <!doctype html><html><head><meta charset="utf-8"><title>Invoice {{inv.invoice_no}}</title>
-    <style>body{font-family:Arial;margin:20px}table{width:100%;border-collapse:collapse}th,td{border:1px solid #ddd;padding:8px}</style>
-    </head><body>
-      <h2>Invoice {{inv.invoice_no}}</h2>
-      <div><strong>Customer:</strong> {{inv.customer_name}}</div>
-      <div><strong>Phone:</strong> {{inv.customer_phone}}</div>
-      <div><strong>Date:</strong> {{inv.date}}</div>
-      <hr>
-      <table><thead><tr><th>Item</th><th>Qty</th><th>Price</th><th>Discount</th><th>Tax</th><th>Amount</th></tr></thead><tbody>
-      {% for it in items %}
-      <tr><td>{{it.item}}</td><td>{{it.qty}}</td><td>₹{{'%.2f'|format(it.price)}}</td><td>{{'%.2f'|format(it.discount)}}</td><td>{{'%.2f'|format(it.tax)}}</td><td>₹{{'%.2f'|format(it.amount)}}</td></tr>
-      {% endfor %}
-      </tbody></table>
-      <h3 style="text-align:right">Total: ₹{{'%.2f'|format(inv.total)}}</h3>
-      <script>window.onload = function(){ window.print(); }</script>
-    </body></html>
-    """, inv=dict(inv), items=[dict(r) for r in items])
-    return html
+    items = db.execute("SELECT item, qty, price, discount, tax, amount FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
+    return render_template("invoice_print.html", inv=dict(inv), items=[dict(r) for r in items])
 
 @app.route("/invoice/<int:inv_id>/pdf", methods=["GET"])
 def invoice_pdf(inv_id):
     db = get_db()
-    inv = db.execute("SELECT * FROM invoices WHERE id=?", (inv_id,)).fetchone()
+    inv = db.execute("SELECT invoice_no, customer_name, date, total FROM invoices WHERE id=?", (inv_id,)).fetchone()
     if not inv:
         return "Not found", 404
-    items = db.execute("SELECT * FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
+    items = db.execute("SELECT item, qty, price, amount FROM invoice_items WHERE invoice_id=?", (inv_id,)).fetchall()
+    # no file target: the PDF is taken as bytes from getpdfdata() below
+    p = canvas.Canvas(None, pagesize=A4)
     width, height = A4
     x = 20*mm
     y = height - 20*mm
@@ -379,41 +527,41 @@ def invoice_pdf(inv_id):
     p.setFont("Helvetica-Bold", 11)
     p.drawRightString(width-x, y, f"Total: ₹{inv['total']:.2f}")
     p.showPage()
-    p.save()
-    buffer.seek(0)
-    return send_file(buffer, mimetype="application/pdf", as_attachment=True, download_name=f"invoice_{inv['invoice_no']}.pdf")
+    pdf = p.getpdfdata()
+    return Response(pdf, mimetype="application/pdf",
+                    headers={"Content-Disposition": f"attachment; filename=invoice_{inv['invoice_no']}.pdf"})
 
 
 # -----------------------
 # CSV Exports
 # -----------------------
+def stream_csv(header, sql, filename):
+    # yield one encoded row at a time so large tables never sit in memory
+    def generate():
+        rows = get_db().execute(sql)
+        buf = StringIO()
+        cw = csv.writer(buf)
+        cw.writerow(header)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        for r in rows:
+            cw.writerow(tuple(r))
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
 @app.route("/export/products.csv", methods=["GET"])
 def export_products_csv():
-    db = get_db()
-    rows = db.execute("SELECT id, name, qty, price, category, default_tax, default_discount FROM products").fetchall()
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(["id","name","qty","price","category","default_tax","default_discount"])
-    for r in rows:
-        cw.writerow([r["id"], r["name"], r["qty"], r["price"], r["category"], r["default_tax"], r["default_discount"]])
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=products.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    sql = "SELECT id, name, qty, price, category, default_tax, default_discount FROM products"
+    return stream_csv(["id","name","qty","price","category","default_tax","default_discount"], sql, "products.csv")
 
 @app.route("/export/invoices.csv", methods=["GET"])
 def export_invoices_csv():
-    db = get_db()
-    rows = db.execute("SELECT id, invoice_no, customer_name, customer_phone, date, total FROM invoices").fetchall()
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(["id","invoice_no","customer_name","customer_phone","date","total"])
-    for r in rows:
-        cw.writerow([r["id"], r["invoice_no"], r["customer_name"], r["customer_phone"], r["date"], r["total"]])
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=invoices.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    sql = "SELECT id, invoice_no, customer_name, customer_phone, date, total FROM invoices"
+    return stream_csv(["id","invoice_no","customer_name","customer_phone","date","total"], sql, "invoices.csv")
 
 
 # -----------------------